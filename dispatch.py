@@ -0,0 +1,185 @@
+import aiohttp
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from pydantic import BaseModel, StringConstraints, ValidationError
+from typing import Annotated, Dict, Any, Callable, List, Optional, Tuple, Type
+from tools import (
+    get_weather, get_stock_price, get_weather_async, get_stock_price_async,
+    WEATHER_CACHE_TTL, STOCK_CACHE_TTL, MAX_TOOL_CALL_SECONDS
+)
+
+# Tools exposed to the model, keyed by the function name the model calls
+TOOLS: Dict[str, Callable[..., Dict[str, Any]]] = {
+    "get_weather": get_weather,
+    "get_stock_price": get_stock_price,
+}
+
+# Async counterparts of TOOLS; each takes an aiohttp session as its first argument
+ASYNC_TOOLS: Dict[str, Callable[..., Any]] = {
+    "get_weather": get_weather_async,
+    "get_stock_price": get_stock_price_async,
+}
+
+# Seconds a result from each tool stays fresh, matching the tools' own caches
+TOOL_TTLS: Dict[str, float] = {
+    "get_weather": WEATHER_CACHE_TTL,
+    "get_stock_price": STOCK_CACHE_TTL,
+}
+
+# Worker threads for running the blocking tools off the caller's thread
+_POOL = ThreadPoolExecutor(max_workers=8, thread_name_prefix="tool")
+
+
+class WeatherArgs(BaseModel):
+    """Arguments accepted by `get_weather`."""
+    city: Annotated[str, StringConstraints(strip_whitespace=True, min_length=1)]
+
+
+class StockArgs(BaseModel):
+    """Arguments accepted by `get_stock_price`."""
+    symbol: Annotated[str, StringConstraints(strip_whitespace=True, min_length=1, max_length=10)]
+
+
+# Argument models for each tool; unknown keys from the model are ignored
+TOOL_ARGS: Dict[str, Type[BaseModel]] = {
+    "get_weather": WeatherArgs,
+    "get_stock_price": StockArgs,
+}
+
+
+def _unknown_tool(tool_name: str) -> Dict[str, Any]:
+    return {
+        "error": f"Unknown tool: {tool_name}. Available tools: {', '.join(TOOLS)}"
+    }
+
+
+def _tool_kwargs(tool_name: str, args: Dict[str, Any]) -> Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
+    """
+    Validates model-supplied arguments before the tool touches the network.
+
+    Returns:
+        A (kwargs, error) tuple; exactly one of the two is None.
+    """
+    try:
+        return TOOL_ARGS[tool_name].model_validate(args).model_dump(), None
+    except ValidationError as e:
+        # Keep only plain strings so the details fit in a FunctionResponse
+        return None, {
+            "error": f"Invalid arguments for {tool_name}.",
+            "details": [
+                {"field": ".".join(str(loc) for loc in err["loc"]), "message": err["msg"]}
+                for err in e.errors()
+            ]
+        }
+
+
+def parse_function_call(function_call: Any) -> Dict[str, Any]:
+    """
+    Converts a Gemini FunctionCall proto into the {"name": ..., "args": ...} form used here.
+
+    Args:
+        function_call: The function_call of a response part
+
+    Returns:
+        Dictionary with the tool name and a plain dict of its arguments
+    """
+    # The args Struct is already a mapping, so dict() copies it in one step
+    args = dict(function_call.args) if function_call.args else {}
+    return {"name": function_call.name, "args": args}
+
+
+def call_tool(tool_name: str, args: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Calls the appropriate tool function based on the tool name.
+
+    Args:
+        tool_name: Name of the tool to call (e.g., 'get_weather', 'get_stock_price')
+        args: Arguments to pass to the tool function
+
+    Returns:
+        Result from the tool function
+    """
+    fn = TOOLS.get(tool_name)
+    if fn is None:
+        return _unknown_tool(tool_name)
+
+    kwargs, error = _tool_kwargs(tool_name, args)
+    if error:
+        return error
+
+    return fn(**kwargs)
+
+
+async def call_tool_async(session: aiohttp.ClientSession, tool_name: str, args: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Async variant of `call_tool` that issues the tool's HTTP request on `session`.
+
+    Args:
+        session: The aiohttp session to issue the tool's HTTP request on
+        tool_name: Name of the tool to call (e.g., 'get_weather', 'get_stock_price')
+        args: Arguments to pass to the tool function
+
+    Returns:
+        Result from the tool function
+    """
+    fn = ASYNC_TOOLS.get(tool_name)
+    if fn is None:
+        return _unknown_tool(tool_name)
+
+    kwargs, error = _tool_kwargs(tool_name, args)
+    if error:
+        return error
+
+    return await fn(session, **kwargs)
+
+
+async def create_tool_session() -> aiohttp.ClientSession:
+    """
+    Creates an aiohttp session for tool calls.
+
+    Must be awaited on the event loop that later runs the tool calls.
+    """
+    return aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=10, ttl_dns_cache=300)
+    )
+
+
+def submit_tool(call: Dict[str, Any]) -> Future:
+    """
+    Starts a tool call on the thread pool without waiting for it.
+
+    Lets callers begin a tool's HTTP request as soon as the model asks for it,
+    while the rest of the model's response is still streaming in.
+
+    Args:
+        call: A {"name": ..., "args": ...} dictionary for one function call
+
+    Returns:
+        Future resolving to the result from the tool function
+    """
+    return _POOL.submit(call_tool, call["name"], call["args"])
+
+
+def collect_tool_results(calls: List[Dict[str, Any]], futures: List[Future], timeout: float = MAX_TOOL_CALL_SECONDS) -> List[Dict[str, Any]]:
+    """
+    Waits for started tool calls and gathers their results.
+
+    Args:
+        calls: List of {"name": ..., "args": ...} dictionaries, one per function call
+        futures: The future for each call, in the same order as `calls`
+        timeout: Seconds to wait for all of the calls to finish; defaults to the
+                 longest a tool can take including its retries
+
+    Returns:
+        Tool results in the same order as `calls`
+    """
+    wait(futures, timeout=timeout)
+
+    results = []
+    for call, future in zip(calls, futures):
+        if future.done():
+            results.append(future.result())
+        else:
+            # Not cancelled: the call (thread or event-loop task) finishes in the
+            # background and still stores its result in the tool cache
+            results.append({"error": f"Tool {call['name']} timed out after {timeout:.0f} seconds."})
+    return results
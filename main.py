@@ -1,8 +1,11 @@
 import os
+import asyncio
+import threading
 import google.generativeai as genai
 from dotenv import load_dotenv
 from tools import get_weather, get_stock_price
-from typing import Dict, Any, List
+from dispatch import call_tool_async, collect_tool_results, create_tool_session, parse_function_call
+from semantic_cache import SemanticCache, append_cached_turn
 import json
 
 # Load environment variables from .env file
@@ -15,39 +18,51 @@ if not api_key:
 
 genai.configure(api_key=api_key)
 
-def call_tool(tool_name: str, args: Dict[str, Any]) -> Dict[str, Any]:
+# Flash handles tool routing and short summaries; Pro is reserved for harder turns
+DEFAULT_MODEL = "gemini-1.5-flash"
+ESCALATION_MODEL = "gemini-1.5-pro-latest"
+
+def pick_model(prompt: str) -> str:
     """
-    Calls the appropriate tool function based on the tool name.
+    Chooses which model should answer a user message.
 
     Args:
-        tool_name: Name of the tool to call (e.g., 'get_weather', 'get_stock_price')
-        args: Arguments to pass to the tool function
+        prompt: The user's message
 
     Returns:
-        Result from the tool function
+        ESCALATION_MODEL for long messages or explicit requests for an explanation,
+        DEFAULT_MODEL otherwise
     """
-    if tool_name == "get_weather":
-        return get_weather(args.get("city"))
-    elif tool_name == "get_stock_price":
-        return get_stock_price(args.get("symbol"))
-    else:
-        return {
-            "error": f"Unknown tool: {tool_name}. Available tools: get_weather, get_stock_price"
-        }
+    if len(prompt) > 400 or "explain" in prompt.lower():
+        return ESCALATION_MODEL
+    return DEFAULT_MODEL
 
 def main():
     """
     The main function for the chatbot. It handles the chat loop, user input,
     and the integration with the Gemini model for function calling.
     """
-    # Create the generative model with tools
-    model = genai.GenerativeModel(
-        model_name="gemini-1.5-pro-latest",
-        tools=[get_weather, get_stock_price]
-    )
+    # Create the generative models with tools, one per routing tier
+    models = {
+        model_name: genai.GenerativeModel(
+            model_name=model_name,
+            tools=[get_weather, get_stock_price]
+        )
+        for model_name in (DEFAULT_MODEL, ESCALATION_MODEL)
+    }
 
     # Start a chat session
-    chat = model.start_chat()
+    chat = models[DEFAULT_MODEL].start_chat()
+
+    # Replies to recent, semantically equivalent questions are served without calling the model
+    semantic_cache = SemanticCache()
+
+    # A single event loop and HTTP session are reused for every tool call. The loop
+    # runs in the background so tool calls can start while the model is still streaming.
+    loop = asyncio.new_event_loop()
+    loop_thread = threading.Thread(target=loop.run_forever, daemon=True)
+    loop_thread.start()
+    session = asyncio.run_coroutine_threadsafe(create_tool_session(), loop).result()
 
     print("LLM Chatbot with Tool Calling initialized!")
     print("I can help you with:")
@@ -67,62 +82,90 @@ def main():
             print("Chatbot: Please enter a message.")
             continue
 
+        # Last known-good history, to restore the chat if this turn fails part way
+        history = list(chat.history)
+
         try:
-            # Send the user's message to the model
-            response = chat.send_message(user_input)
+            cached_reply = semantic_cache.get(user_input)
+            if cached_reply is not None:
+                print(f"\nChatbot: {cached_reply}\n")
+                append_cached_turn(chat, user_input, cached_reply)
+                continue
 
-            # Print the initial response from the model
-            print(f"\nChatbot: ", end="")
+            # Route this turn to the appropriate model; the chat history is shared
+            chat.model = models[pick_model(user_input)]
+
+            # Send the user's message to the model, streaming the reply
+            response = chat.send_message(user_input, stream=True)
 
-            # Process the response
-            if response.candidates and response.candidates[0].content.parts:
-                for part in response.candidates[0].content.parts:
+            # Print the initial response from the model
+            print(f"\nChatbot: ", end="", flush=True)
+
+            # Process the response as it streams in, starting every tool call the model requests
+            function_calls = []
+            tool_futures = []
+            tool_results = []
+            reply = ""
+            for chunk in response:
+                if not (chunk.candidates and chunk.candidates[0].content.parts):
+                    continue
+
+                for part in chunk.candidates[0].content.parts:
                     if hasattr(part, 'text') and part.text:
-                        print(part.text, end="")
+                        print(part.text, end="", flush=True)
+                        reply += part.text
 
                     # Check if the model wants to call a tool
-                    elif hasattr(part, 'function_call'):
+                    elif hasattr(part, 'function_call') and part.function_call.name:
                         # Extract function name and arguments
-                        function_call = part.function_call
-                        function_name = function_call.name
-
-                        # Convert proto to dict for arguments
-                        args_dict = {}
-                        if function_call.args:
-                            # Convert protobuf Struct to regular dict
-                            for key, value in function_call.args.items():
-                                args_dict[key] = value
-
-                        print(f"\n[Calling tool: {function_name} with args: {args_dict}]")
-
-                        # Call the tool function
-                        tool_result = call_tool(function_name, args_dict)
-
-                        print(f"[Tool result: {tool_result}]")
-
-                        # Send the tool's response back to the model
-                        second_response = chat.send_message(
-                            genai.protos.Content(
-                                parts=[
-                                    genai.protos.Part(
-                                        function_response=genai.protos.FunctionResponse(
-                                            name=function_name,
-                                            response=tool_result
-                                        )
-                                    )
-                                ]
+                        call = parse_function_call(part.function_call)
+
+                        print(f"\n[Calling tool: {call['name']} with args: {call['args']}]")
+                        function_calls.append(call)
+                        tool_futures.append(asyncio.run_coroutine_threadsafe(
+                            call_tool_async(session, call["name"], call["args"]), loop
+                        ))
+
+            # Make sure the full turn is recorded in the chat history
+            response.resolve()
+
+            if function_calls:
+                # Wait for the tools, which have been running since they were requested
+                tool_results = collect_tool_results(function_calls, tool_futures)
+
+                for tool_result in tool_results:
+                    print(f"[Tool result: {tool_result}]")
+
+                # Send all of the tools' responses back to the model in one message
+                second_response = chat.send_message(
+                    genai.protos.Content(
+                        parts=[
+                            genai.protos.Part(
+                                function_response=genai.protos.FunctionResponse(
+                                    name=call["name"],
+                                    response=tool_result
+                                )
                             )
-                        )
-
-                        # Print the final response from the model after processing tool result
-                        if second_response.candidates and second_response.candidates[0].content.parts:
-                            print("\nChatbot: ", end="")
-                            for part in second_response.candidates[0].content.parts:
-                                if hasattr(part, 'text') and part.text:
-                                    print(part.text, end="")
-
-                        print("\n")  # Extra newline for readability
-                        continue  # Skip the normal response printing since we handled it above
+                            for call, tool_result in zip(function_calls, tool_results)
+                        ]
+                    ),
+                    stream=True
+                )
+
+                # Stream the final response from the model after processing tool results
+                print("\nChatbot: ", end="", flush=True)
+                for chunk in second_response:
+                    if not (chunk.candidates and chunk.candidates[0].content.parts):
+                        continue
+
+                    for part in chunk.candidates[0].content.parts:
+                        if hasattr(part, 'text') and part.text:
+                            print(part.text, end="", flush=True)
+                            reply += part.text
+                second_response.resolve()
+
+            if reply:
+                semantic_cache.put(user_input, reply, function_calls, tool_results)
 
             print("\n")  # Extra newline for readability
 
@@ -130,6 +173,15 @@ def main():
             print(f"An error occurred: {str(e)}")
             print("Please try again.\n")
 
+            # Drop the failed turn (a broken stream or an unanswered function
+            # call) so the next message is not rejected as well
+            chat = models[DEFAULT_MODEL].start_chat(history=history)
+
+    asyncio.run_coroutine_threadsafe(session.close(), loop).result()
+    loop.call_soon_threadsafe(loop.stop)
+    loop_thread.join()
+    loop.close()
+
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
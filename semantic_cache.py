@@ -0,0 +1,237 @@
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional
+
+import faiss
+import google.generativeai as genai
+import numpy as np
+from sentence_transformers import SentenceTransformer
+
+from dispatch import TOOL_TTLS
+
+logger = logging.getLogger(__name__)
+
+# Encoders are shared by every cache in the process and loaded on first use.
+# After a failed load (e.g. offline) the cache stays disabled for a while
+# instead of retrying on every message.
+_ENCODER_RETRY_SECONDS = 300
+_ENCODERS: Dict[str, SentenceTransformer] = {}
+_ENCODER_FAILURES: Dict[str, float] = {}
+_ENCODERS_LOCK = threading.Lock()
+
+
+def _get_encoder(model_name: str) -> Optional[SentenceTransformer]:
+    """Returns the shared encoder, or None if it is unavailable or still loading."""
+    encoder = _ENCODERS.get(model_name)
+    if encoder is not None:
+        return encoder
+
+    failed_at = _ENCODER_FAILURES.get(model_name)
+    if failed_at is not None and time.monotonic() - failed_at < _ENCODER_RETRY_SECONDS:
+        return None
+
+    # Another thread is already loading it; treat this lookup as a miss rather than wait
+    if not _ENCODERS_LOCK.acquire(blocking=False):
+        return None
+    try:
+        if model_name not in _ENCODERS:
+            _ENCODERS[model_name] = SentenceTransformer(model_name)
+            _ENCODER_FAILURES.pop(model_name, None)
+        return _ENCODERS[model_name]
+    except Exception:
+        logger.warning("Could not load sentence encoder %s; semantic cache disabled", model_name, exc_info=True)
+        _ENCODER_FAILURES[model_name] = time.monotonic()
+        return None
+    finally:
+        _ENCODERS_LOCK.release()
+
+
+_WORD = re.compile(r"\w+")
+
+# Words that may sit next to a tool argument without changing which city or
+# symbol it names (e.g. "London's", "the price of AAPL")
+_FUNCTION_WORDS = frozenset({"s", "a", "an", "the", "in", "of", "for", "at", "on", "is", "and", "about"})
+
+
+def _names_same_entities(prompt: str, entry: Dict[str, Any]) -> bool:
+    """
+    Checks that a prompt asks about the same cities or symbols as a cached reply.
+
+    Embeddings rate prompts that differ only in the entity ("GOOG" vs "GOOGL",
+    "York" vs "New York") as near duplicates. So every tool argument of the
+    cached reply must appear in the prompt as whole words, and the words right
+    next to it must not turn it into a different name.
+    """
+    words = _WORD.findall(prompt.lower())
+    allowed_neighbours = _FUNCTION_WORDS | set(_WORD.findall(entry["prompt"].lower()))
+
+    for call in entry["tool_calls"]:
+        for value in call["args"].values():
+            arg = _WORD.findall(str(value).lower())
+            if not arg:
+                continue
+
+            size = len(arg)
+            if not any(
+                words[i:i + size] == arg
+                and all(word in allowed_neighbours for word in words[max(i - 1, 0):i] + words[i + size:i + size + 1])
+                for i in range(len(words) - size + 1)
+            ):
+                return False
+    return True
+
+
+def append_cached_turn(chat: genai.ChatSession, prompt: str, reply: str) -> None:
+    """
+    Records a turn answered from the cache in the chat history, so the model
+    sees the same conversation as the user.
+    """
+    chat.history = [
+        *chat.history,
+        genai.protos.Content(role="user", parts=[genai.protos.Part(text=prompt)]),
+        genai.protos.Content(role="model", parts=[genai.protos.Part(text=reply)])
+    ]
+
+
+class SemanticCache:
+    """
+    In-memory cache of chatbot replies keyed by the meaning of the user's message.
+
+    Prompts are embedded with a small local sentence-transformers model and
+    searched by cosine similarity, so "weather in London?" and "what's London's
+    weather like?" can share one answer. A hit must also name the same cities
+    and symbols the cached reply looked up. A cache belongs to one conversation;
+    replies are never shared between users. Entries expire with the shortest
+    TTL of the tools used to produce them (`ttl` if none were used), and the
+    least recently used entry is evicted once `max_entries` is reached.
+
+    The cache fails open: if the encoder or index is unavailable, lookups are
+    misses and stores are skipped.
+    """
+
+    def __init__(
+        self,
+        model_name: str = "all-MiniLM-L6-v2",
+        threshold: float = 0.92,
+        max_entries: int = 512,
+        ttl: float = 600
+    ):
+        self.model_name = model_name
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+
+        self._index: Optional[faiss.IndexIDMap] = None
+        self._entries: "OrderedDict[int, Dict[str, Any]]" = OrderedDict()
+        self._next_id = 0
+        self._last_embedding: Optional[tuple] = None
+        self._lock = threading.Lock()
+
+    def _embed(self, prompt: str) -> Optional[np.ndarray]:
+        """Returns the L2-normalized embedding of a prompt, reusing the last one if unchanged."""
+        last = self._last_embedding
+        if last and last[0] == prompt:
+            return last[1]
+
+        encoder = _get_encoder(self.model_name)
+        if encoder is None:
+            return None
+
+        embedding = encoder.encode(
+            [prompt], normalize_embeddings=True, convert_to_numpy=True
+        ).astype(np.float32)
+        self._last_embedding = (prompt, embedding)
+        return embedding
+
+    def _remove(self, entry_id: int) -> None:
+        self._index.remove_ids(np.array([entry_id], dtype=np.int64))
+        del self._entries[entry_id]
+
+    def get(self, prompt: str) -> Optional[str]:
+        """
+        Looks up a cached reply for a semantically equivalent prompt.
+
+        Args:
+            prompt: The user's message
+
+        Returns:
+            The cached reply text, or None if no fresh entry is similar enough
+        """
+        try:
+            embedding = self._embed(prompt)
+            if embedding is None:
+                return None
+
+            with self._lock:
+                if not self._entries:
+                    return None
+
+                scores, ids = self._index.search(embedding, 1)
+                score, entry_id = float(scores[0, 0]), int(ids[0, 0])
+                if entry_id < 0 or score < self.threshold:
+                    return None
+
+                entry = self._entries[entry_id]
+                if time.monotonic() > entry["expires"]:
+                    self._remove(entry_id)
+                    return None
+
+                if not _names_same_entities(prompt, entry):
+                    return None
+
+                self._entries.move_to_end(entry_id)
+                return entry["response"]
+        except Exception:
+            logger.warning("Semantic cache lookup failed", exc_info=True)
+            return None
+
+    def put(
+        self,
+        prompt: str,
+        response: str,
+        tool_calls: Optional[List[Dict[str, Any]]] = None,
+        tool_results: Optional[List[Dict[str, Any]]] = None
+    ) -> None:
+        """
+        Stores the reply produced for a prompt.
+
+        Replies built from a failed or stale tool result are not stored.
+
+        Args:
+            prompt: The user's message
+            response: The final reply text shown to the user
+            tool_calls: The {"name": ..., "args": ...} tool calls made for the reply, if any
+            tool_results: The results of `tool_calls`, in the same order
+        """
+        tool_calls = tool_calls or []
+        if any("error" in result or result.get("stale") for result in tool_results or []):
+            return
+
+        ttl = min([TOOL_TTLS.get(call["name"], self.ttl) for call in tool_calls], default=self.ttl)
+
+        try:
+            embedding = self._embed(prompt)
+            if embedding is None:
+                return
+
+            with self._lock:
+                if self._index is None:
+                    self._index = faiss.IndexIDMap(faiss.IndexFlatIP(embedding.shape[1]))
+
+                while len(self._entries) >= self.max_entries:
+                    self._remove(next(iter(self._entries)))
+
+                entry_id = self._next_id
+                self._next_id += 1
+                self._index.add_with_ids(embedding, np.array([entry_id], dtype=np.int64))
+                self._entries[entry_id] = {
+                    "prompt": prompt,
+                    "tool_calls": tool_calls,
+                    "response": response,
+                    "expires": time.monotonic() + ttl
+                }
+        except Exception:
+            logger.warning("Semantic cache store failed", exc_info=True)
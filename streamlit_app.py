@@ -2,7 +2,8 @@ import streamlit as st
 import google.generativeai as genai
 from dotenv import load_dotenv
 from tools import get_weather, get_stock_price
-from typing import Dict, Any
+from dispatch import collect_tool_results, parse_function_call, submit_tool
+from semantic_cache import SemanticCache, append_cached_turn
 import os
 
 # Load environment variables from .env file
@@ -16,25 +17,15 @@ if not api_key:
 
 genai.configure(api_key=api_key)
 
-def call_tool(tool_name: str, args: Dict[str, Any]) -> Dict[str, Any]:
+@st.cache_resource
+def get_model() -> genai.GenerativeModel:
     """
-    Calls the appropriate tool function based on the tool name.
-
-    Args:
-        tool_name: Name of the tool to call (e.g., 'get_weather', 'get_stock_price')
-        args: Arguments to pass to the tool function
-
-    Returns:
-        Result from the tool function
+    Builds the generative model with tools once and shares it across reruns and sessions.
     """
-    if tool_name == "get_weather":
-        return get_weather(args.get("city"))
-    elif tool_name == "get_stock_price":
-        return get_stock_price(args.get("symbol"))
-    else:
-        return {
-            "error": f"Unknown tool: {tool_name}. Available tools: get_weather, get_stock_price"
-        }
+    return genai.GenerativeModel(
+        model_name="gemini-1.5-flash",
+        tools=[get_weather, get_stock_price]
+    )
 
 def main():
     st.set_page_config(
@@ -50,8 +41,13 @@ def main():
     if "messages" not in st.session_state:
         st.session_state.messages = []
 
-    if "chat_history" not in st.session_state:
-        st.session_state.chat_history = []
+    # Gemini history of the turns that completed in this session
+    if "completed_history" not in st.session_state:
+        st.session_state.completed_history = []
+
+    # Replies are only reused within the conversation that produced them
+    if "semantic_cache" not in st.session_state:
+        st.session_state.semantic_cache = SemanticCache()
 
     # Sidebar with instructions
     with st.sidebar:
@@ -81,7 +77,6 @@ def main():
     if prompt := st.chat_input("Ask about weather, stock prices, or anything else..."):
         # Add user message to chat history
         st.session_state.messages.append({"role": "user", "content": prompt})
-        # For Gemini, we'll format the history correctly when starting the chat
 
         with st.chat_message("user"):
             st.markdown(prompt)
@@ -91,89 +86,97 @@ def main():
             full_response = ""
 
             try:
-                # Create the generative model with tools
-                model = genai.GenerativeModel(
-                    model_name="gemini-1.5-pro-latest",
-                    tools=[get_weather, get_stock_price]
-                )
-
-                # Format the chat history for Gemini
-                formatted_history = []
-                for msg in st.session_state.chat_history[:-1]:  # Exclude current user message
-                    if msg["role"] == "user":
-                        formatted_history.append(
-                            genai.protos.Content(
-                                role="user",
-                                parts=[genai.protos.Part(text=msg["content"])]
-                            )
-                        )
-                    elif msg["role"] == "assistant":
-                        formatted_history.append(
-                            genai.protos.Content(
-                                role="model",  # Gemini uses "model" instead of "assistant"
-                                parts=[genai.protos.Part(text=msg["content"])]
-                            )
-                        )
-
-                # Start a chat session with the history
-                chat = model.start_chat(history=formatted_history)
-
-                # Send the user's message to the model
-                response = chat.send_message(prompt)
-
-                # Process the response
-                if response.candidates and response.candidates[0].content.parts:
-                    for part in response.candidates[0].content.parts:
-                        if hasattr(part, 'text') and part.text:
-                            full_response += part.text
-                            message_placeholder.markdown(full_response + "▌")
-
-                        # Check if the model wants to call a tool
-                        elif hasattr(part, 'function_call'):
-                            # Extract function name and arguments
-                            function_call = part.function_call
-                            function_name = function_call.name
-
-                            # Convert proto to dict for arguments
-                            args_dict = {}
-                            if function_call.args:
-                                # Convert protobuf Struct to regular dict
-                                for key, value in function_call.args.items():
-                                    args_dict[key] = value
-
-                            # Show tool call in chat
-                            tool_call_msg = f"🔍 Calling tool: {function_name} with args: {args_dict}"
-                            full_response += f"\n{tool_call_msg}\n"
-                            message_placeholder.markdown(full_response + "▌")
-
-                            # Call the tool function
-                            tool_result = call_tool(function_name, args_dict)
-
-                            # Show tool result
+                # Start every turn from the last completed history. A turn that fails,
+                # or that Streamlit stops part way for a rerun (a BaseException), never
+                # saves its history, so a broken stream or an unanswered function call
+                # is dropped here instead of being sent again.
+                chat = get_model().start_chat(history=st.session_state.completed_history)
+
+                semantic_cache = st.session_state.semantic_cache
+                cached_reply = semantic_cache.get(prompt)
+                if cached_reply is not None:
+                    # A semantically equivalent question was answered recently
+                    full_response = cached_reply
+                    append_cached_turn(chat, prompt, cached_reply)
+                else:
+                    # Send the user's message to the model, streaming the reply
+                    response = chat.send_message(prompt, stream=True)
+
+                    # Process the response as it streams in, starting every tool call the model requests
+                    function_calls = []
+                    tool_futures = []
+                    tool_results = []
+                    # The model's own text, without the tool call and result lines shown in the UI
+                    model_reply = ""
+                    for chunk in response:
+                        if not (chunk.candidates and chunk.candidates[0].content.parts):
+                            continue
+
+                        for part in chunk.candidates[0].content.parts:
+                            if hasattr(part, 'text') and part.text:
+                                full_response += part.text
+                                model_reply += part.text
+                                message_placeholder.markdown(full_response + "▌")
+
+                            # Check if the model wants to call a tool
+                            elif hasattr(part, 'function_call') and part.function_call.name:
+                                # Extract function name and arguments
+                                call = parse_function_call(part.function_call)
+
+                                # Show tool call in chat
+                                tool_call_msg = f"🔍 Calling tool: {call['name']} with args: {call['args']}"
+                                full_response += f"\n{tool_call_msg}\n"
+                                message_placeholder.markdown(full_response + "▌")
+
+                                function_calls.append(call)
+                                tool_futures.append(submit_tool(call))
+
+                    # Make sure the full turn is recorded in the chat history
+                    response.resolve()
+
+                    if function_calls:
+                        # Wait for the tools, which have been running since they were requested
+                        tool_results = collect_tool_results(function_calls, tool_futures)
+
+                        # Show tool results
+                        for tool_result in tool_results:
                             tool_result_msg = f"📊 Tool result: {tool_result}"
                             full_response += f"\n{tool_result_msg}\n"
-                            message_placeholder.markdown(full_response + "▌")
-
-                            # Send the tool's response back to the model
-                            second_response = chat.send_message(
-                                genai.protos.Content(
-                                    parts=[
-                                        genai.protos.Part(
-                                            function_response=genai.protos.FunctionResponse(
-                                                name=function_name,
-                                                response=tool_result
-                                            )
+                        message_placeholder.markdown(full_response + "▌")
+
+                        # Send all of the tools' responses back to the model in one message
+                        second_response = chat.send_message(
+                            genai.protos.Content(
+                                parts=[
+                                    genai.protos.Part(
+                                        function_response=genai.protos.FunctionResponse(
+                                            name=call["name"],
+                                            response=tool_result
                                         )
-                                    ]
-                                )
-                            )
+                                    )
+                                    for call, tool_result in zip(function_calls, tool_results)
+                                ]
+                            ),
+                            stream=True
+                        )
+
+                        # Stream the final response from the model after processing tool results
+                        for chunk in second_response:
+                            if not (chunk.candidates and chunk.candidates[0].content.parts):
+                                continue
+
+                            for part in chunk.candidates[0].content.parts:
+                                if hasattr(part, 'text') and part.text:
+                                    full_response += part.text
+                                    model_reply += part.text
+                                    message_placeholder.markdown(full_response + "▌")
+                        second_response.resolve()
+
+                    if model_reply:
+                        semantic_cache.put(prompt, model_reply, function_calls, tool_results)
 
-                            # Process the final response from the model after processing tool result
-                            if second_response.candidates and second_response.candidates[0].content.parts:
-                                for part in second_response.candidates[0].content.parts:
-                                    if hasattr(part, 'text') and part.text:
-                                        full_response += part.text
-                                        message_placeholder.markdown(full_response + "▌")
+                # The turn completed, so its history is safe to build on
+                st.session_state.completed_history = list(chat.history)
 
                 # Remove the cursor
                 message_placeholder.markdown(full_response)
@@ -185,7 +188,6 @@ def main():
 
         # Add assistant response to chat history
         st.session_state.messages.append({"role": "assistant", "content": full_response})
-        st.session_state.chat_history.append({"role": "assistant", "content": full_response})
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
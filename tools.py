@@ -1,10 +1,285 @@
 import os
+import asyncio
+import threading
+import time
+from collections import deque
+from operator import itemgetter
+import aiohttp
+import diskcache
+import orjson
 import requests
-from typing import Dict, Any
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from typing import Dict, Any, Optional, Tuple
+from cachetools import LRUCache, TTLCache
 from dotenv import load_dotenv
 
 load_dotenv()
 
+WEATHER_API_URL = "https://api.openweathermap.org/data/2.5/weather"
+STOCK_API_URL = "https://www.alphavantage.co/query"
+
+# In-process caches for successful tool results. Weather changes slowly, so it
+# can be cached longer than stock quotes. Error results are never cached.
+WEATHER_CACHE_TTL = 600
+STOCK_CACHE_TTL = 60
+_WEATHER_CACHE: TTLCache = TTLCache(maxsize=1024, ttl=WEATHER_CACHE_TTL)
+_STOCK_CACHE: TTLCache = TTLCache(maxsize=2048, ttl=STOCK_CACHE_TTL)
+_CACHE_LOCK = threading.Lock()
+
+# Last successful result per key, kept past its TTL so a previous value can be
+# served while the upstream API is rate limited.
+_LAST_GOOD: LRUCache = LRUCache(maxsize=2048)
+
+# Alpha Vantage's free tier allows a handful of requests per minute. Requests
+# beyond the budget are not sent, since the API would only reject them. The
+# budget is tracked in the disk cache so every process sharing the API key
+# counts against it; the in-process window is the fallback without a disk cache.
+_STOCK_CALLS_PER_MINUTE = int(os.getenv("ALPHA_VANTAGE_CALLS_PER_MINUTE", "5"))
+_STOCK_CALLS_KEY = "ratelimit:alpha_vantage"
+_STOCK_CALLS: deque = deque(maxlen=_STOCK_CALLS_PER_MINUTE)
+_STOCK_CALLS_LOCK = threading.Lock()
+
+# Alpha Vantage reports throttling and exhausted quotas with HTTP 200 and one of
+# these keys ("Note" in older responses, "Information" in current ones).
+_STOCK_THROTTLE_KEYS = frozenset({"Note", "Information"})
+
+# On-disk cache behind the in-process ones, shared by every process of this
+# user (e.g. Streamlit workers) and kept across restarts. It lives in a per-user
+# directory because diskcache unpickles what it reads. Disk errors are treated
+# as cache misses, and the cache is skipped entirely if it cannot be opened.
+_CACHE_DIR = os.getenv(
+    "TOOL_CACHE_DIR",
+    os.path.join(os.getenv("XDG_CACHE_HOME", os.path.expanduser("~/.cache")), "tool-calling")
+)
+try:
+    _DISK_CACHE: Optional[diskcache.Cache] = diskcache.Cache(_CACHE_DIR, size_limit=64 * 1024 * 1024)
+except Exception:
+    _DISK_CACHE = None
+
+# Shared HTTP session so repeat calls reuse pooled keep-alive connections
+# instead of paying for a new TCP/TLS handshake on every request.
+_REQUEST_TIMEOUT = (3.05, 5)
+_REQUEST_RETRIES = 3
+_RETRY_BACKOFF = 0.2
+_SESSION = requests.Session()
+_ADAPTER = HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=20,
+    max_retries=Retry(
+        total=_REQUEST_RETRIES,
+        backoff_factor=_RETRY_BACKOFF,
+        status_forcelist=[429, 500, 502, 503, 504],
+        raise_on_status=False
+    )
+)
+_SESSION.mount("https://", _ADAPTER)
+_SESSION.mount("http://", _ADAPTER)
+
+# Every Alpha Vantage request counts against its rate limit, so throttled (429)
+# responses are not retried there; only server errors are.
+_STOCK_ADAPTER = HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=20,
+    max_retries=Retry(
+        total=_REQUEST_RETRIES,
+        backoff_factor=_RETRY_BACKOFF,
+        status_forcelist=[500, 502, 503, 504],
+        raise_on_status=False
+    )
+)
+_SESSION.mount(STOCK_API_URL, _STOCK_ADAPTER)
+
+# Longest a blocking tool call can take: every attempt hitting the connect and
+# read timeouts, plus the backoff sleeps between retries.
+MAX_TOOL_CALL_SECONDS = (
+    sum(_REQUEST_TIMEOUT) * (_REQUEST_RETRIES + 1)
+    + _RETRY_BACKOFF * (2 ** _REQUEST_RETRIES - 1)
+)
+
+# Ask for compressed payloads; requests and aiohttp decode them transparently
+# (Brotli requires the brotli package).
+REQUEST_HEADERS = {"Accept-Encoding": "gzip, br", "User-Agent": "tool-calling/1.0"}
+_SESSION.headers.update(REQUEST_HEADERS)
+
+# Same connect/read budget for the async variants.
+_ASYNC_TIMEOUT = aiohttp.ClientTimeout(sock_connect=3.05, sock_read=5)
+
+# Only these fields of the upstream payloads are used; a missing one raises KeyError.
+_WEATHER_ROOT_FIELDS = itemgetter("name", "main", "weather", "wind", "sys")
+_WEATHER_MAIN_FIELDS = itemgetter("temp", "humidity")
+_STOCK_FIELDS = itemgetter("01. symbol", "05. price", "07. latest trading day")
+
+
+def _cache_get(cache: TTLCache, key: str) -> Optional[Dict[str, Any]]:
+    """Returns a copy of a cached tool result, or None on a miss."""
+    with _CACHE_LOCK:
+        cached = cache.get(key)
+    if cached is None and _DISK_CACHE is not None:
+        # Not promoted into the in-process cache, which would restart its TTL
+        try:
+            cached = _DISK_CACHE.get(key)
+        except Exception:
+            cached = None
+    return dict(cached) if cached is not None else None
+
+
+def _cache_put(cache: TTLCache, key: str, value: Dict[str, Any]) -> Dict[str, Any]:
+    """Stores a successful tool result and returns a copy for the caller."""
+    with _CACHE_LOCK:
+        cache[key] = value
+        _LAST_GOOD[key] = value
+    if _DISK_CACHE is not None:
+        try:
+            _DISK_CACHE.set(key, value, expire=cache.ttl)
+            _DISK_CACHE.set(f"last_good:{key}", value)
+        except Exception:
+            pass
+    return dict(value)
+
+
+def _acquire_stock_call() -> bool:
+    """Records an Alpha Vantage request if the per-minute budget allows it."""
+    if _DISK_CACHE is not None:
+        try:
+            with _DISK_CACHE.transact():
+                now = time.time()
+                calls = [t for t in _DISK_CACHE.get(_STOCK_CALLS_KEY, ()) if now - t <= 60]
+                allowed = len(calls) < _STOCK_CALLS_PER_MINUTE
+                if allowed:
+                    calls.append(now)
+                _DISK_CACHE.set(_STOCK_CALLS_KEY, calls, expire=60)
+            return allowed
+        except Exception:
+            pass
+
+    now = time.monotonic()
+    with _STOCK_CALLS_LOCK:
+        while _STOCK_CALLS and now - _STOCK_CALLS[0] > 60:
+            _STOCK_CALLS.popleft()
+        if len(_STOCK_CALLS) >= _STOCK_CALLS_PER_MINUTE:
+            return False
+        _STOCK_CALLS.append(now)
+        return True
+
+
+def _stock_rate_limited(key: str, symbol: str) -> Dict[str, Any]:
+    """Returns the last known price marked as stale, or a rate limit error if there is none."""
+    with _CACHE_LOCK:
+        last_good = _LAST_GOOD.get(key)
+    if last_good is None and _DISK_CACHE is not None:
+        try:
+            last_good = _DISK_CACHE.get(f"last_good:{key}")
+        except Exception:
+            last_good = None
+    if last_good is not None:
+        return {**last_good, "stale": True}
+    return {
+        "error": "API rate limit exceeded. Please try again later.",
+        "symbol": symbol
+    }
+
+
+def _weather_request(city: str) -> Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
+    """
+    Builds the OpenWeatherMap query parameters for a city.
+
+    Returns:
+        A (params, error) tuple; exactly one of the two is None.
+    """
+    api_key = os.getenv("WEATHER_API_KEY")
+    if not api_key:
+        return None, {
+            "error": "Weather API key not configured. Please set the WEATHER_API_KEY environment variable.",
+            "city": city
+        }
+    return {"q": city, "appid": api_key, "units": "metric"}, None
+
+
+def _weather_status_error(status_code: int, city: str) -> Optional[Dict[str, Any]]:
+    """Maps a non-200 OpenWeatherMap status code to an error result."""
+    if status_code == 401:
+        return {
+            "error": "Invalid API key. Please check your WEATHER_API_KEY in the .env file.",
+            "city": city
+        }
+    elif status_code == 404:
+        return {
+            "error": f"City '{city}' not found. Please check the spelling and try again.",
+            "city": city
+        }
+    elif status_code != 200:
+        return {
+            "error": f"Failed to retrieve weather data. Status code: {status_code}",
+            "city": city
+        }
+    return None
+
+
+def _parse_weather(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Extracts the weather fields from an OpenWeatherMap payload. Raises KeyError."""
+    name, main, weather, wind, sys_info = _WEATHER_ROOT_FIELDS(data)
+    temp, humidity = _WEATHER_MAIN_FIELDS(main)
+    return {
+        "city": name,
+        "temperature": round(temp, 1),
+        "description": weather[0]["description"],
+        "humidity": humidity,
+        "wind_speed": wind["speed"],
+        "country": sys_info["country"]
+    }
+
+
+def _stock_request(symbol: str) -> Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
+    """
+    Builds the Alpha Vantage query parameters for a stock symbol.
+
+    Returns:
+        A (params, error) tuple; exactly one of the two is None.
+    """
+    api_key = os.getenv("ALPHA_VANTAGE_API_KEY")
+    if not api_key:
+        return None, {
+            "error": "Alpha Vantage API key not configured. Please set the ALPHA_VANTAGE_API_KEY environment variable.",
+            "symbol": symbol
+        }
+    return {
+        "function": "GLOBAL_QUOTE",
+        "symbol": symbol,
+        "apikey": api_key
+    }, None
+
+
+def _parse_stock(data: Dict[str, Any], symbol: str) -> Dict[str, Any]:
+    """
+    Converts an Alpha Vantage GLOBAL_QUOTE payload into a tool result.
+
+    The returned dictionary contains an 'error' key when the API reported a
+    problem. Raises KeyError or ValueError on an unexpected payload.
+    """
+    # Check if the API returned an error message
+    if "Error Message" in data:
+        return {
+            "error": f"Invalid stock symbol '{symbol}'. Please check the symbol and try again.",
+            "symbol": symbol
+        }
+
+    quote_data = data.get("Global Quote", {})
+    if not quote_data:
+        return {
+            "error": f"No data available for stock symbol '{symbol}'.",
+            "symbol": symbol
+        }
+
+    quote_symbol, price, last_updated = _STOCK_FIELDS(quote_data)
+    return {
+        "symbol": quote_symbol,
+        "price": float(price),
+        "currency": "USD",
+        "last_updated": last_updated
+    }
+
+
 def get_weather(city: str) -> Dict[str, Any]:
     """
     Fetches the current weather for a given city using the OpenWeatherMap API.
@@ -28,47 +303,33 @@ def get_weather(city: str) -> Dict[str, Any]:
     Raises:
         No exceptions are raised; errors are returned in the 'error' field.
     """
-    api_key = os.getenv("WEATHER_API_KEY")
-    if not api_key:
+    if not isinstance(city, str) or not city.strip():
         return {
-            "error": "Weather API key not configured. Please set the WEATHER_API_KEY environment variable.",
+            "error": "A city name is required to fetch the weather.",
             "city": city
         }
 
-    base_url = "http://api.openweathermap.org/data/2.5/weather"
-    params = {"q": city, "appid": api_key, "units": "metric"}
+    cache_key = f"weather:{city.strip().lower()}"
+    cached = _cache_get(_WEATHER_CACHE, cache_key)
+    if cached is not None:
+        return cached
+
+    params, error = _weather_request(city)
+    if error:
+        return error
 
     try:
-        response = requests.get(base_url, params=params)
+        response = _SESSION.get(WEATHER_API_URL, params=params, timeout=_REQUEST_TIMEOUT)
 
-        if response.status_code == 401:
-            return {
-                "error": "Invalid API key. Please check your WEATHER_API_KEY in the .env file.",
-                "city": city
-            }
-        elif response.status_code == 404:
-            return {
-                "error": f"City '{city}' not found. Please check the spelling and try again.",
-                "city": city
-            }
-        elif response.status_code != 200:
-            return {
-                "error": f"Failed to retrieve weather data. Status code: {response.status_code}",
-                "city": city
-            }
+        error = _weather_status_error(response.status_code, city)
+        if error:
+            return error
 
-        data = response.json()
+        data = orjson.loads(response.content)
 
-        weather_info = {
-            "city": data["name"],
-            "temperature": round(data["main"]["temp"], 1),
-            "description": data["weather"][0]["description"],
-            "humidity": data["main"]["humidity"],
-            "wind_speed": data["wind"]["speed"],
-            "country": data["sys"]["country"]
-        }
+        weather_info = _parse_weather(data)
 
-        return weather_info
+        return _cache_put(_WEATHER_CACHE, cache_key, weather_info)
 
     except requests.exceptions.ConnectionError:
         return {
@@ -85,7 +346,7 @@ def get_weather(city: str) -> Dict[str, Any]:
             "error": f"A request error occurred: {str(e)}",
             "city": city
         }
-    except KeyError:
+    except (KeyError, orjson.JSONDecodeError):
         return {
             "error": "Unexpected response format from the weather API.",
             "city": city
@@ -114,27 +375,32 @@ def get_stock_price(symbol: str) -> Dict[str, Any]:
         - price: Current stock price in USD
         - currency: Currency of the price ('USD')
         - last_updated: Date of the last price update
+        - stale: True if this is an earlier price returned while rate limited (only present then)
         - error: Error message if API call fails (only present if there's an error)
 
     Raises:
         No exceptions are raised; errors are returned in the 'error' field.
     """
-    api_key = os.getenv("ALPHA_VANTAGE_API_KEY")
-    if not api_key:
+    if not isinstance(symbol, str) or not symbol.strip():
         return {
-            "error": "Alpha Vantage API key not configured. Please set the ALPHA_VANTAGE_API_KEY environment variable.",
+            "error": "A stock symbol is required to fetch the stock price.",
             "symbol": symbol
         }
 
-    base_url = "https://www.alphavantage.co/query"
-    params = {
-        "function": "GLOBAL_QUOTE",
-        "symbol": symbol,
-        "apikey": api_key
-    }
+    cache_key = f"stock:{symbol.strip().upper()}"
+    cached = _cache_get(_STOCK_CACHE, cache_key)
+    if cached is not None:
+        return cached
+
+    params, error = _stock_request(symbol)
+    if error:
+        return error
+
+    if not _acquire_stock_call():
+        return _stock_rate_limited(cache_key, symbol)
 
     try:
-        response = requests.get(base_url, params=params)
+        response = _SESSION.get(STOCK_API_URL, params=params, timeout=_REQUEST_TIMEOUT)
 
         if response.status_code != 200:
             return {
@@ -142,36 +408,17 @@ def get_stock_price(symbol: str) -> Dict[str, Any]:
                 "symbol": symbol
             }
 
-        data = response.json()
-
-        # Check if the API returned an error message
-        if "Error Message" in data:
-            return {
-                "error": f"Invalid stock symbol '{symbol}'. Please check the symbol and try again.",
-                "symbol": symbol
-            }
-
-        if "Note" in data:
-            return {
-                "error": "API rate limit exceeded. Please try again later.",
-                "symbol": symbol
-            }
+        data = orjson.loads(response.content)
 
-        quote_data = data.get("Global Quote", {})
-        if not quote_data:
-            return {
-                "error": f"No data available for stock symbol '{symbol}'.",
-                "symbol": symbol
-            }
+        if not _STOCK_THROTTLE_KEYS.isdisjoint(data):
+            # Throttled upstream despite the local budget
+            return _stock_rate_limited(cache_key, symbol)
 
-        stock_info = {
-            "symbol": quote_data["01. symbol"],
-            "price": float(quote_data["05. price"]),
-            "currency": "USD",
-            "last_updated": quote_data["07. latest trading day"]
-        }
+        stock_info = _parse_stock(data, symbol)
+        if "error" in stock_info:
+            return stock_info
 
-        return stock_info
+        return _cache_put(_STOCK_CACHE, cache_key, stock_info)
 
     except requests.exceptions.ConnectionError:
         return {
@@ -197,4 +444,151 @@ def get_stock_price(symbol: str) -> Dict[str, Any]:
         return {
             "error": f"An unexpected error occurred: {str(e)}",
             "symbol": symbol
-        }
\ No newline at end of file
+        }
+
+
+async def get_weather_async(session: aiohttp.ClientSession, city: str) -> Dict[str, Any]:
+    """
+    Async variant of `get_weather` that performs the request on an aiohttp session.
+
+    Shares the result cache with `get_weather` and returns the same dictionary
+    shape, so callers can use the two interchangeably.
+
+    Args:
+        session: An open aiohttp client session to issue the request on.
+        city: The name of the city for which to fetch the weather.
+
+    Returns:
+        The same weather dictionary returned by `get_weather`.
+    """
+    if not isinstance(city, str) or not city.strip():
+        return {
+            "error": "A city name is required to fetch the weather.",
+            "city": city
+        }
+
+    cache_key = f"weather:{city.strip().lower()}"
+    cached = _cache_get(_WEATHER_CACHE, cache_key)
+    if cached is not None:
+        return cached
+
+    params, error = _weather_request(city)
+    if error:
+        return error
+
+    try:
+        async with session.get(WEATHER_API_URL, params=params, headers=REQUEST_HEADERS, timeout=_ASYNC_TIMEOUT) as response:
+            error = _weather_status_error(response.status, city)
+            if error:
+                return error
+
+            data = orjson.loads(await response.read())
+
+        weather_info = _parse_weather(data)
+
+        return _cache_put(_WEATHER_CACHE, cache_key, weather_info)
+
+    except aiohttp.ClientConnectionError:
+        return {
+            "error": "Unable to connect to the weather service. Please check your internet connection.",
+            "city": city
+        }
+    except asyncio.TimeoutError:
+        return {
+            "error": "Request timed out while connecting to the weather service.",
+            "city": city
+        }
+    except aiohttp.ClientError as e:
+        return {
+            "error": f"A request error occurred: {str(e)}",
+            "city": city
+        }
+    except (KeyError, orjson.JSONDecodeError):
+        return {
+            "error": "Unexpected response format from the weather API.",
+            "city": city
+        }
+    except Exception as e:
+        return {
+            "error": f"An unexpected error occurred: {str(e)}",
+            "city": city
+        }
+
+
+async def get_stock_price_async(session: aiohttp.ClientSession, symbol: str) -> Dict[str, Any]:
+    """
+    Async variant of `get_stock_price` that performs the request on an aiohttp session.
+
+    Shares the result cache with `get_stock_price` and returns the same
+    dictionary shape, so callers can use the two interchangeably.
+
+    Args:
+        session: An open aiohttp client session to issue the request on.
+        symbol: The stock symbol for which to fetch the price.
+
+    Returns:
+        The same stock dictionary returned by `get_stock_price`.
+    """
+    if not isinstance(symbol, str) or not symbol.strip():
+        return {
+            "error": "A stock symbol is required to fetch the stock price.",
+            "symbol": symbol
+        }
+
+    cache_key = f"stock:{symbol.strip().upper()}"
+    cached = _cache_get(_STOCK_CACHE, cache_key)
+    if cached is not None:
+        return cached
+
+    params, error = _stock_request(symbol)
+    if error:
+        return error
+
+    if not _acquire_stock_call():
+        return _stock_rate_limited(cache_key, symbol)
+
+    try:
+        async with session.get(STOCK_API_URL, params=params, headers=REQUEST_HEADERS, timeout=_ASYNC_TIMEOUT) as response:
+            if response.status != 200:
+                return {
+                    "error": f"Failed to retrieve stock data. Status code: {response.status}",
+                    "symbol": symbol
+                }
+
+            data = orjson.loads(await response.read())
+
+        if not _STOCK_THROTTLE_KEYS.isdisjoint(data):
+            # Throttled upstream despite the local budget
+            return _stock_rate_limited(cache_key, symbol)
+
+        stock_info = _parse_stock(data, symbol)
+        if "error" in stock_info:
+            return stock_info
+
+        return _cache_put(_STOCK_CACHE, cache_key, stock_info)
+
+    except aiohttp.ClientConnectionError:
+        return {
+            "error": "Unable to connect to the stock service. Please check your internet connection.",
+            "symbol": symbol
+        }
+    except asyncio.TimeoutError:
+        return {
+            "error": "Request timed out while connecting to the stock service.",
+            "symbol": symbol
+        }
+    except aiohttp.ClientError as e:
+        return {
+            "error": f"A request error occurred: {str(e)}",
+            "symbol": symbol
+        }
+    except (KeyError, ValueError):
+        return {
+            "error": "Unexpected response format from the stock API.",
+            "symbol": symbol
+        }
+    except Exception as e:
+        return {
+            "error": f"An unexpected error occurred: {str(e)}",
+            "symbol": symbol
+        }